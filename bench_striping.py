@@ -0,0 +1,89 @@
+"""Write/read throughput of StripedDriver with 1, 2 and 4 members.
+
+Members are image files in one temporary directory, so they all sit on the
+same disk and mostly in the page cache. Striping cannot add bandwidth then:
+the numbers show what splitting a transfer and driving members from a
+thread pool costs. Gains only appear with members on separate devices.
+"""
+import os
+import tempfile
+from time import perf_counter
+
+from device import StorageDevice
+from driver import Driver
+from file_system import FileSystem
+from striped_driver import StripedDriver
+
+Byte = int
+
+block_size: Byte = 4096
+member_size: Byte = 16 * 2**20
+transfer_size: Byte = 8 * 2**20
+repeats = 10
+# an inode holds a limited block map, so fs writes are spread over files
+file_size: Byte = block_size * 32
+files_number = 32
+
+
+def make_driver(directory: str, members: int) -> StripedDriver:
+    drivers = [
+        Driver(StorageDevice(member_size, os.path.join(directory, f"member{i}")))
+        for i in range(members)
+    ]
+    return StripedDriver(drivers, stripe_unit=block_size)
+
+
+def bench_raw(driver: StripedDriver) -> tuple[float, float]:
+    payload = os.urandom(transfer_size)
+    start = perf_counter()
+    for _ in range(repeats):
+        driver.write(0, payload)
+    write_time = perf_counter() - start
+
+    start = perf_counter()
+    for _ in range(repeats):
+        driver.read(0, transfer_size)
+    read_time = perf_counter() - start
+    return write_time, read_time
+
+
+def bench_fs(driver: StripedDriver) -> float:
+    fs = FileSystem(driver, block_size, inodes_number=64)
+    fds = []
+    for i in range(files_number):
+        fs.create(f"/file{i}")
+        fds.append(fs.open(f"/file{i}"))
+    payload = b"x" * file_size
+    start = perf_counter()
+    for _ in range(repeats):
+        for fd in fds:
+            fs.seek(fd, 0)
+            fs.write(fd, payload, len(payload))
+            # writes only reach the device when the file is flushed
+            fs.fsync(fd)
+    return perf_counter() - start
+
+
+def main():
+    mb = transfer_size * repeats / 2**20
+    fs_mb = file_size * files_number * repeats / 2**20
+    print(f"{'members':>8} {'write MB/s':>11} {'read MB/s':>10} {'fs write MB/s':>14}")
+    for members in (1, 2, 4):
+        with tempfile.TemporaryDirectory() as directory:
+            driver = make_driver(directory, members)
+            write_time, read_time = bench_raw(driver)
+            driver.close()
+
+        with tempfile.TemporaryDirectory() as directory:
+            driver = make_driver(directory, members)
+            fs_write_time = bench_fs(driver)
+            driver.close()
+
+        print(
+            f"{members:>8} {mb / write_time:>11.2f} {mb / read_time:>10.2f} "
+            f"{fs_mb / fs_write_time:>14.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
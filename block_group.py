@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+from checksum import checksum_size
+from writable import Bitmap, Writable
+
+Byte = int
+
+
+class BlockGroup:
+    """Layout and cached allocation state of one block group.
+
+    On disk a group is its block bitmap, its inode bitmap, its inode table,
+    the crc32 of each data block and its data blocks. The free counts and the
+    bitmap checksums are kept in the group descriptor table at the start of
+    the device, so allocation can skip full groups unread.
+    """
+
+    descriptor_size = 160
+
+    def __init__(
+        self,
+        index: int,
+        offset: int,
+        blocks_number: int,
+        inodes_number: int,
+        inode_size: Byte,
+    ) -> None:
+        self.index = index
+        self.blocks_number = blocks_number
+        self.inodes_number = inodes_number
+        self.block_bitmap_offset = offset
+        self.inode_bitmap_offset = offset + self.bitmap_size(blocks_number)
+        self.inode_table_offset = self.inode_bitmap_offset + self.bitmap_size(
+            inodes_number
+        )
+        self.checksums_offset = self.inode_table_offset + inodes_number * inode_size
+        self.data_offset = self.checksums_offset + blocks_number * checksum_size
+        self.free_blocks = blocks_number
+        self.free_inodes = inodes_number
+        self.block_bitmap_checksum = 0
+        self.inode_bitmap_checksum = 0
+        self.block_bitmap: Bitmap | None = None
+        self.inode_bitmap: Bitmap | None = None
+
+    @property
+    def descriptor_offset(self) -> int:
+        return self.index * self.descriptor_size
+
+    @property
+    def descriptor(self) -> Writable:
+        return Writable(
+            {
+                "free_blocks": self.free_blocks,
+                "free_inodes": self.free_inodes,
+                "block_bitmap_checksum": self.block_bitmap_checksum,
+                "inode_bitmap_checksum": self.inode_bitmap_checksum,
+            }
+        )
+
+    @descriptor.setter
+    def descriptor(self, value: Writable) -> None:
+        self.free_blocks = value.content["free_blocks"]
+        self.free_inodes = value.content["free_inodes"]
+        self.block_bitmap_checksum = value.content["block_bitmap_checksum"]
+        self.inode_bitmap_checksum = value.content["inode_bitmap_checksum"]
+
+    @staticmethod
+    def bitmap_size(n: int) -> int:
+        return Bitmap("0" * n).size
+
+    @classmethod
+    def size(
+        cls, blocks_number: int, inodes_number: int, block_size: Byte, inode_size: Byte
+    ) -> int:
+        return (
+            cls.bitmap_size(blocks_number)
+            + cls.bitmap_size(inodes_number)
+            + inodes_number * inode_size
+            + blocks_number * (checksum_size + block_size)
+        )
@@ -0,0 +1,31 @@
+from zlib import crc32
+
+from fs_exceptions import ChecksumMismatch, InvalidSize
+
+Byte = int
+
+checksum_size: Byte = 4
+
+
+def checksum(data: bytes) -> int:
+    return crc32(data)
+
+
+def checksum_bytes(data: bytes) -> bytes:
+    return crc32(data).to_bytes(checksum_size, "little")
+
+
+def seal(data: bytes, size: Byte) -> bytes:
+    """Pad `data` to a `size` byte slot whose last bytes are its crc32."""
+    if len(data) > size - checksum_size:
+        # never spill into the next slot
+        raise InvalidSize
+    body = data.ljust(size - checksum_size, b"\x00")
+    return body + checksum_bytes(body)
+
+
+def unseal(raw: bytes) -> bytes:
+    body = raw[:-checksum_size]
+    if checksum_bytes(body) != raw[-checksum_size:]:
+        raise ChecksumMismatch
+    return body
@@ -0,0 +1,26 @@
+from __future__ import annotations
+
+import lzma
+import zlib
+
+from fs_exceptions import UnknownCompression
+
+codecs = {
+    "zlib": (zlib.compress, zlib.decompress),
+    "lzma": (lzma.compress, lzma.decompress),
+}
+
+
+def check_codec(codec: str | None) -> None:
+    if codec is not None and codec not in codecs:
+        raise UnknownCompression(codec)
+
+
+def compress(codec: str, data: bytes) -> bytes:
+    check_codec(codec)
+    return codecs[codec][0](data)
+
+
+def decompress(codec: str, data: bytes) -> bytes:
+    check_codec(codec)
+    return codecs[codec][1](data)
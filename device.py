@@ -1,4 +1,4 @@
-from os.path import exists
+from os.path import exists, getsize
 
 from fs_exceptions import *
 
@@ -10,12 +10,14 @@ class StorageDevice:
         self._size = size
         self._path = path
         if exists(path) and use_existing:
-            with open(path, "r") as f:
-                if len(f.read()) / 8 != size:
-                    raise InvalidSize
+            if getsize(path) != size:
+                raise InvalidSize
         else:
-            with open(path, "w") as f:
-                f.write("0" * size * 8)
+            if size <= 0:
+                raise InvalidSize
+            # a sparse raw image: no data is written, unread ranges are zeros
+            with open(path, "wb") as f:
+                f.truncate(size)
 
     @property
     def size(self) -> Byte:
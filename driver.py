@@ -1,5 +1,4 @@
 from device import StorageDevice
-from bin_serializer import bytes_to_bits, bytes_from_bits
 
 Byte = int
 Address = int
@@ -19,16 +18,16 @@ class Driver:
         return self._device_size
 
     def write(self, address: Address, data: bytes) -> None:
-        with open(self._path, "r+") as storage:
-            storage.seek(8 * address)
-            storage.write(bytes_to_bits(data))
+        with open(self._path, "r+b") as storage:
+            storage.seek(address)
+            storage.write(data)
 
     def read(self, address: Address, n_bytes: int) -> bytes:
-        with open(self._path, "r") as storage:
-            storage.seek(8 * address)
-            return bytes_from_bits(storage.read(8 * n_bytes))
+        with open(self._path, "rb") as storage:
+            storage.seek(address)
+            return storage.read(n_bytes).ljust(n_bytes, b"\x00")
 
     def clear(self, address: Address, n_bytes: int) -> None:
-        with open(self._path, "r+") as storage:
-            storage.seek(8 * address)
-            storage.write("0" * 8 * n_bytes)
+        with open(self._path, "r+b") as storage:
+            storage.seek(address)
+            storage.write(bytes(n_bytes))
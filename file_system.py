@@ -1,11 +1,20 @@
+from __future__ import annotations
+
 import re
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
 from pathlib import PurePosixPath
-from pickle import dumps, loads
-from typing import Type
+from pickle import loads
+from typing import Callable, Type
 
+from block_group import BlockGroup
+from checksum import checksum, checksum_bytes, checksum_size, seal, unseal
+from compression import check_codec, decompress
 from driver import Driver
 from files import File, Directory, Symlink, RegularFile
-from writable import Bitmap, Inode, Data
+from open_file_table import FileDescriptor, OpenFile, OpenFileTable
+from readahead import Readahead
+from writable import Bitmap, Inode, Data, Writable
 from fs_exceptions import *
 
 Byte = int
@@ -15,6 +24,12 @@ Address = int
 class FileSystem:
     __inode_size = 256
     __max_open_files_number = 10000
+    __compression_chunk_blocks = 4
+    __snapshots_dir = "/.snapshots"
+    __max_dirty_bytes = 1024 * 1024
+    __max_symlink_follows = 40
+    __group_blocks_factor = 8
+    __scrub_blocks = 256
 
     def __init__(
         self,
@@ -22,27 +37,43 @@ class FileSystem:
         block_size: Byte,
         inodes_number: int,
         use_existing: bool = False,
+        compression: str = None,
+        dedup: bool = False,
     ) -> None:
-        self.data_blocks_number = self._calculate_data_blocks_number(
-            driver.device_size, block_size, inodes_number, self.__inode_size
-        )
+        check_codec(compression)
+        if block_size <= 0:
+            raise InvalidSize
         self._driver = driver
-
-        self.bitmap = Bitmap("0" * self.data_blocks_number, offset=0)
-        self._driver.write(self.bitmap.offset, self.bitmap.dumped)
-
         self._block_size = block_size
-        self._inode_sector_offset = self.bitmap.offset + self.bitmap.size + 1
-        self._inodes_number = inodes_number
-        self._data_sector_offset = (
-            self._inode_sector_offset + 1 + self.__inode_size * self._inodes_number
-        )
+        self._blocks_per_group = self.__group_blocks_factor * block_size
+        self._groups = self._plan_groups(driver.device_size, inodes_number)
+        self._inodes_per_group = self._groups[0].inodes_number
+        self._inodes_number = self._inodes_per_group * len(self._groups)
+        self.data_blocks_number = sum(g.blocks_number for g in self._groups)
+        if use_existing:
+            self._mount_groups()
+        else:
+            self._format_groups()
+
+        self._compression = compression
+        self._compression_chunk_size = block_size * self.__compression_chunk_blocks
+        self._dedup = dedup
+        self._dedup_index: dict[bytes, Address] = {}
+        self._block_digests: dict[Address, bytes] = {}
 
         if not use_existing:
             self._create_directory("/")
         self._cwd = PurePosixPath("/")
 
-        self._open_files = {}
+        self._open_files = OpenFileTable(self.__max_open_files_number)
+        # ids of open inodes written since their last flush
+        self._dirty_files: set[int] = set()
+        # blocks promised to dirty files, by inode id
+        self._reserved_blocks: dict[int, int] = {}
+        # symlink inode id -> inode id it resolves to, reset on any namespace change
+        self._symlink_cache: dict[int, int] = {}
+        self._readahead_pool = None
+        self.readahead_stats = {"prefetched": 0, "hits": 0, "wasted": 0}
 
     def ls(self) -> str:
         return str(self._read_directory(self._cwd))
@@ -51,67 +82,85 @@ class FileSystem:
         inode_id = self._get_file_inode_id(
             self._resolve_path(path), return_symlink_inode_id=True
         )
+        self._flush(inode_id)
         inode = self._read_inode(inode_id)
+        inode.content["physical_size"] = (
+            len(inode.content.get("data_blocks_map")) * self._block_size
+        )
         return inode
 
-    def create(self, path: str) -> None:
-        self._create_file(path=self._resolve_path(path), file_cls=RegularFile)
+    def create(self, path: str, compression: str = None) -> None:
+        compression = compression or self._compression
+        check_codec(compression)
+        self._create_file(
+            path=self._resolve_path(path),
+            file_cls=RegularFile,
+            compression=compression,
+        )
 
     def open(self, path: str) -> int:
-        if len(self._open_files) > self.__max_open_files_number:
-            raise TooManyFilesOpen
-
         inode_id = self._get_file_inode_id(self._resolve_path(path))
-        inode = self._read_inode(inode_id)
-        addresses = inode.content.get("data_blocks_map")
-        if len(addresses) == 0:
-            data = None
-        else:
-            data = self._read_data(addresses)
-        file_descriptor = max(self._open_files, default=0) + 1
-        self._open_files[file_descriptor] = RegularFile(inode, data)
-        return file_descriptor
+        open_file: OpenFile = self._open_files.get_inode(inode_id)
+        if open_file is None:
+            return self._open_files.open(self._read_inode(inode_id))
+        # later descriptors share the state of the first one
+        return self._open_files.open(open_file.inode)
 
     def close(self, fd: int) -> None:
-        if fd in self._open_files:
-            self._open_files.pop(fd)
-        else:
-            raise WrongFileDescriptorNumber
+        file: FileDescriptor = self._open_files.get(fd)
+        inode_id = file.inode.content["id"]
+        try:
+            self._flush(inode_id)
+        finally:
+            # like close(2) the descriptor is released even if the flush fails
+            self._open_files.close(fd)
+            self.readahead_stats["wasted"] += file.readahead.discard()
+            if not self._open_files.is_open(inode_id):
+                self._dirty_files.discard(inode_id)
+                self._reserved_blocks.pop(inode_id, None)
 
     def seek(self, fd: int, seek: int) -> None:
-        if fd in self._open_files:
-            self._open_files.get(fd).seek = seek
-        else:
-            raise WrongFileDescriptorNumber
+        self._open_files.get(fd).seek = seek
 
     def read(self, fd: int, size: Byte) -> bytes:
-        if fd in self._open_files:
-            read_value: bytes = self._open_files.get(fd).read(size)
-            return read_value
-        else:
-            raise WrongFileDescriptorNumber
+        file: FileDescriptor = self._open_files.get(fd)
+        if file.data is not None:
+            return file.read(size)
+        # data is read on demand, only the blocks a read touches
+        inode_record: dict = file.inode.content
+        start, end = file.advance(size, inode_record["file_size"])
+        if "inline_data" in inode_record:
+            return inode_record["inline_data"].encode()[start:end]
+        if inode_record.get("compression") is not None:
+            return self._read_compressed_range(inode_record, start, end, file)
+        if start >= end:
+            return b""
+        first = start // self._block_size
+        last = (end - 1) // self._block_size
+        data = self._read_file_blocks(file, inode_record, first, last)
+        offset = first * self._block_size
+        return data[start - offset: end - offset]
 
     def write(self, fd: int, data: bytes, size: Byte) -> None:
-        if fd in self._open_files:
-            file: RegularFile = self._open_files.get(fd)
-            updated_file: RegularFile = file.write(data, size)
-            file_data: Data = updated_file.data
-            inode_record: dict = updated_file.inode.content
-            addresses = self._allocate_blocks(file_data)
-            size = len(file_data.dumped)
-            self._write_data(addresses, file_data)
-
-            self._clear_data_block(inode_record["data_blocks_map"])
-
-            inode_record["file_size"] = len(file_data.content.encode())
-            inode_record["data_blocks_map"] = addresses
-            inode = Inode(inode_record)
-            self._write_inode(inode)
-
-            self._open_files[fd] = RegularFile(inode, file_data, file.seek)
-
-        else:
-            raise WrongFileDescriptorNumber
+        file: FileDescriptor = self._open_files.get(fd)
+        if file.inode.content.get("read_only"):
+            raise ReadOnlySnapshot
+        if file.data is None:
+            file.data = self._read_file_data(file.inode)
+        # blocks are allocated when the file is flushed, see _flush, but
+        # reserved now so that the flush cannot run out of them
+        self._reserve_blocks(file, file.written_content(data, size))
+        file.write(data, size)
+        self._dirty_files.add(file.inode.content["id"])
+        if self._dirty_bytes() > self.__max_dirty_bytes:
+            self._sync()
+
+    def fsync(self, fd: int) -> None:
+        self._flush(self._open_files.get(fd).inode.content["id"])
+
+    def sync(self) -> None:
+        """Flush every open file with unwritten data."""
+        self._sync()
 
     def link(self, file_path: str, link_path: str) -> None:
         f_path: PurePosixPath = self._resolve_path(file_path)
@@ -121,10 +170,14 @@ class FileSystem:
         inode_record: dict = inode.content
         if inode_record.get("file_type") == "d":
             raise DirectoryLinkException("Cannot create hardlink for directory")
+        if inode_record.get("read_only"):
+            raise ReadOnlySnapshot
 
+        # nothing is written before the grown inode is known to fit and the
+        # entry is added, a failure leaves no half-made link behind
         inode_record["file_name"].append(l_path.name)
         inode_record["links_cnt"] += 1
-
+        self._check_inode_fits(inode_record)
         l_parent_directory: Directory = self._read_directory(l_path.parent)
         self._add_file_to_parent_directory_entry(
             l_parent_directory,
@@ -133,14 +186,14 @@ class FileSystem:
             inode_record["file_type"],
         )
 
+        self._spill_inline(inode_record)
         self._write_inode(Inode(inode_record))
 
     def unlink(self, path: str) -> None:
         path: PurePosixPath = self._resolve_path(path)
         inode_id: int = self._get_file_inode_id(path)
-        for open_file in self._open_files.values():
-            if open_file.inode.content.get("id") == inode_id:
-                raise CannotUnlinkOpenFile
+        if self._open_files.is_open(inode_id):
+            raise CannotUnlinkOpenFile
         inode: Inode = self._read_inode(inode_id)
         inode_record: dict = inode.content
 
@@ -150,35 +203,36 @@ class FileSystem:
         inode_record["file_name"].remove(path.name)
         inode_record["links_cnt"] -= 1
 
+        parent: Directory = self._read_directory(path.parent)
+        self._remove_file_from_parent_directory_entry(
+            parent, path.name, inode_record["file_type"]
+        )
+
         if inode_record["links_cnt"] == 0:
             self._clear_data_block(inode_record["data_blocks_map"])
             self._clear_inode(inode_record["id"])
-
-        parent: Directory = self._read_directory(path.parent)
-
-        self._remove_file_from_parent_directory_entry(parent, path.name)
-        self._write_inode(Inode(inode_record))
+        else:
+            self._write_inode(Inode(inode_record))
 
     def truncate(self, path: str, size: int) -> None:
         path: PurePosixPath = self._resolve_path(path)
+        inode_id = self._get_file_inode_id(path)
+        self._flush(inode_id)
 
-        inode: Inode = self._read_inode(self._get_file_inode_id(path))
-        addresses = inode.content.get("data_blocks_map")
-        if len(addresses) == 0:
-            data = None
-        else:
-            data = self._read_data(addresses)
+        inode: Inode = self._read_inode(inode_id)
+        if inode.content.get("read_only"):
+            raise ReadOnlySnapshot
+        data = self._read_file_data(inode)
+        if data is None:
+            return
 
         file: RegularFile = RegularFile(inode, data).truncate(size)
-        file_data: Data = file.data
-        inode_record: dict = file.inode.content
-        size = len(file_data.dumped)
-        self._write_data(addresses, file_data)
-
-        inode_record["file_size"] = len(file_data.content.encode())
-        inode_record["data_blocks_map"] = addresses
-
-        self._write_inode(Inode(inode_record))
+        inode = self._write_file_data(file.inode.content, file.data)
+        open_file: OpenFile = self._open_files.get_inode(inode.content["id"])
+        if open_file is not None:
+            # descriptors read the truncated file back from disk
+            open_file.inode = inode
+            open_file.data = None
 
     def mkdir(self, path: str) -> None:
         if path == "/":
@@ -197,11 +251,11 @@ class FileSystem:
         if len(directory.data.content) > 2:
             raise CannotRemoveDirectory("directory is not empty")
 
+        self._remove_file_from_parent_directory_entry(parent, path.name, "d")
+
         self._clear_data_block(directory.inode.content["data_blocks_map"])
         self._clear_inode(directory.inode.content["id"])
 
-        self._remove_file_from_parent_directory_entry(parent, path.name)
-
     def cd(self, path: str) -> None:
         resolved_path: PurePosixPath = self._resolve_path(path)
         inode_id: int = self._get_file_inode_id(
@@ -209,18 +263,166 @@ class FileSystem:
         )
         inode: Inode = self._read_inode(inode_id)
         if inode.content.get("file_type") == "l":
-            symlink_path = self._read_data(inode.content.get("data_blocks_map")).content
-            resolved_path = self._resolve_path(symlink_path)
+            resolved_path = self._symlink_target(inode)
         self.cwd = self._absolutize(resolved_path)
 
     def symlink(self, file_path: str, link_path: str) -> None:
         c_path = self._resolve_path(file_path)
         s_path = self._resolve_path(link_path)
-        data = Data(str(c_path))
-        if len(data.dumped) > self._block_size:
-            raise TooLongSymlink
+        self._create_symlink(s_path, str(c_path))
+
+    def clone(self, src_path: str, dst_path: str) -> None:
+        """Copy a file or a directory tree sharing data blocks copy-on-write."""
+        src: PurePosixPath = self._resolve_path(src_path)
+        dst: PurePosixPath = self._resolve_path(dst_path)
+        self._clone_inode(self._get_file_inode_id(src), dst, read_only=False, cloned={})
+
+    def snapshot(self, name: str) -> None:
+        """Read-only copy of the whole namespace under /.snapshots/<name>.
+
+        Only inodes and directory entries are copied, file data blocks are
+        shared with the live tree.
+        """
+        root: Directory = self._read_directory(PurePosixPath("/"))
+        if self.__snapshots_dir[1:] not in root.data.content:
+            self._create_directory(self.__snapshots_dir)
+        snapshots_id = self._get_file_inode_id(PurePosixPath(self.__snapshots_dir))
+        self._clone_inode(
+            0,
+            PurePosixPath(self.__snapshots_dir).joinpath(name),
+            read_only=True,
+            cloned={},
+            skip=snapshots_id,
+        )
 
-        self._create_file(path=s_path, data=data, file_cls=Symlink)
+    def dedup(self) -> float:
+        """Offline pass merging identical data blocks of regular files.
+
+        Rebuilds the block index from every regular file on the image and
+        returns the resulting dedup ratio.
+        """
+        self._sync()
+        self._dedup_index = {}
+        self._block_digests = {}
+        for file in self._open_files.descriptors():
+            self.readahead_stats["wasted"] += file.readahead.discard()
+        for inode in self._iter_inodes():
+            inode_record: dict = inode.content
+            if inode_record.get("file_type") != "f":
+                continue
+            addresses = inode_record["data_blocks_map"]
+            changed = False
+            for i, addr in enumerate(addresses):
+                digest = self._block_digests.get(addr)
+                if digest is None:
+                    digest = self._block_digest(self._read_blocks([addr]))
+                shared = self._dedup_index.get(digest)
+                if (
+                    shared is not None
+                    and shared != addr
+                    and self._refcount(shared) < Bitmap.max_refcount
+                ):
+                    self._update_refcounts([shared], Bitmap.incref)
+                    self._clear_data_block([addr])
+                    addresses[i] = shared
+                    changed = True
+                elif shared is None:
+                    self._dedup_index[digest] = addr
+                    self._block_digests[addr] = digest
+            if changed:
+                self._write_inode(Inode(inode_record))
+                open_file: OpenFile = self._open_files.get_inode(inode_record["id"])
+                if open_file is not None:
+                    open_file.inode.content["data_blocks_map"] = list(addresses)
+        return self.dedup_ratio()
+
+    def dedup_ratio(self) -> float:
+        """Block references per used physical block."""
+        references = 0
+        used = 0
+        for group in self._groups:
+            bitmap = self._block_bitmap(group)
+            used += group.blocks_number - group.free_blocks
+            references += sum(bitmap.refcount(i) for i in range(group.blocks_number))
+        if used == 0:
+            return 1.0
+        return references / used
+
+    def scan_group(self, index: int) -> dict:
+        """Read and verify everything block group `index` holds, for fsck.
+
+        Returns the block refcounts and the inodes the group's bitmaps mark
+        as used, the entries of its directories and the problems found.
+        """
+        self._sync()
+        group = self._groups[index]
+        problems = []
+        refcounts: dict[Address, int] = {}
+        inodes: dict[int, dict] = {}
+        entries: dict[int, dict] = {}
+
+        try:
+            block_bitmap = self._block_bitmap(group).content
+        except ChecksumMismatch as e:
+            problems.append(f"checksum mismatch: {e}")
+            block_bitmap = ""
+        base = index * self._blocks_per_group
+        used = [base + m.start() for m in re.finditer("[^0]", block_bitmap)]
+        for addr in used:
+            refcounts[addr] = self._refcount(addr)
+        for i in range(0, len(used), self.__scrub_blocks):
+            batch = used[i: i + self.__scrub_blocks]
+            try:
+                self._read_blocks(batch)
+            except ChecksumMismatch:
+                # find the bad blocks one by one
+                for addr in batch:
+                    try:
+                        self._read_blocks([addr])
+                    except ChecksumMismatch as e:
+                        problems.append(f"checksum mismatch: {e}")
+
+        try:
+            inode_bitmap = self._inode_bitmap(group).content
+        except ChecksumMismatch as e:
+            problems.append(f"checksum mismatch: {e}")
+            inode_bitmap = None
+        table = self._driver.read(
+            group.inode_table_offset, group.inodes_number * self.__inode_size
+        )
+        empty = bytes(self.__inode_size)
+        for pos in range(group.inodes_number):
+            inode_id = index * self._inodes_per_group + pos
+            raw = table[pos * self.__inode_size: (pos + 1) * self.__inode_size]
+            if inode_bitmap is None:
+                # the bitmap is unreadable, go by the slots themselves
+                marked = raw != empty
+            else:
+                marked = inode_bitmap[pos] != "0"
+            if not marked:
+                if raw != empty:
+                    problems.append(f"inode {inode_id}: in use but marked free")
+                continue
+            if raw == empty:
+                problems.append(f"inode {inode_id}: marked used but empty")
+                continue
+            try:
+                inode = self._read_inode(inode_id)
+            except ChecksumMismatch as e:
+                problems.append(f"checksum mismatch: {e}")
+                continue
+            inodes[inode_id] = inode.content
+            if inode.content["file_type"] == "d":
+                try:
+                    entries[inode_id] = self._read_entry(inode).content
+                except ChecksumMismatch as e:
+                    problems.append(f"checksum mismatch: {e}")
+        return {
+            "refcounts": refcounts,
+            "inodes": inodes,
+            "entries": entries,
+            "problems": problems,
+        }
 
     @property
     def cwd(self) -> PurePosixPath:
@@ -230,17 +432,182 @@ class FileSystem:
     def cwd(self, path: PurePosixPath) -> None:
         self._cwd = path
 
-    @staticmethod
-    def _calculate_data_blocks_number(
-        device_size: int, block_size: int, inodes_number: int, inodes_size: int
-    ) -> int:
-        data_blocks_number = (device_size - (inodes_number * inodes_size)) // block_size
-        bitmap_blocks_number = 0
+    @property
+    def driver(self) -> Driver:
+        return self._driver
+
+    @property
+    def block_size(self) -> Byte:
+        return self._block_size
+
+    @property
+    def inodes_number(self) -> int:
+        return self._inodes_number
+
+    @property
+    def groups_number(self) -> int:
+        return len(self._groups)
+
+    def _plan_groups(self, device_size: int, inodes_number: int) -> list[BlockGroup]:
+        """Split the device into the descriptor table and equal block groups.
+
+        Only the last group may hold fewer data blocks. Inodes are spread
+        evenly, so the number of groups and of inodes per group depend on
+        each other; a few rounds settle them.
+        """
+        block_size = self._block_size
+        groups_number = max(
+            1, -(-device_size // (self._blocks_per_group * block_size))
+        )
+        for _ in range(8):
+            inodes_per_group = max(1, -(-inodes_number // groups_number))
+            full_size = BlockGroup.size(
+                self._blocks_per_group, inodes_per_group, block_size, self.__inode_size
+            )
+            available = device_size - groups_number * BlockGroup.descriptor_size
+            full_groups, rest = divmod(max(available, 0), full_size)
+
+            last_blocks = max(
+                0,
+                (rest - BlockGroup.size(0, inodes_per_group, block_size, self.__inode_size))
+                // (block_size + checksum_size + 1),
+            )
+            while last_blocks > 0 and rest < BlockGroup.size(
+                last_blocks, inodes_per_group, block_size, self.__inode_size
+            ):
+                last_blocks -= 1
+            sizes = [self._blocks_per_group] * full_groups
+            if last_blocks > 0:
+                sizes.append(last_blocks)
+            if len(sizes) == groups_number or len(sizes) == 0:
+                break
+            groups_number = len(sizes)
+        if len(sizes) == 0:
+            raise InvalidSize
+
+        groups = []
+        offset = len(sizes) * BlockGroup.descriptor_size
+        for index, blocks_number in enumerate(sizes):
+            groups.append(
+                BlockGroup(
+                    index,
+                    offset + index * full_size,
+                    blocks_number,
+                    inodes_per_group,
+                    self.__inode_size,
+                )
+            )
+        return groups
+
+    def _format_groups(self) -> None:
+        for group in self._groups:
+            self._write_block_bitmap(
+                group, Bitmap("0" * group.blocks_number, group.block_bitmap_offset)
+            )
+            self._write_inode_bitmap(
+                group, Bitmap("0" * group.inodes_number, group.inode_bitmap_offset)
+            )
+
+    def _mount_groups(self) -> None:
+        # only the descriptor table is read, bitmaps are loaded on first use
+        table = self._driver.read(
+            0, len(self._groups) * BlockGroup.descriptor_size
+        )
+        for group in self._groups:
+            start = group.descriptor_offset
+            group.descriptor = Writable(
+                loads(unseal(table[start: start + BlockGroup.descriptor_size]))
+            )
 
-        while bitmap_blocks_number * block_size - len(dumps("")) < data_blocks_number:
-            bitmap_blocks_number += 1
-        data_blocks_number -= bitmap_blocks_number
-        return data_blocks_number
+    def _write_group_descriptor(self, group: BlockGroup) -> None:
+        self._driver.write(
+            group.descriptor_offset,
+            seal(group.descriptor.dumped, BlockGroup.descriptor_size),
+        )
+
+    def _block_bitmap(self, group: BlockGroup) -> Bitmap:
+        if group.block_bitmap is None:
+            raw = self._driver.read(
+                group.block_bitmap_offset, BlockGroup.bitmap_size(group.blocks_number)
+            )
+            if checksum(raw) != group.block_bitmap_checksum:
+                raise ChecksumMismatch(f"block bitmap of group {group.index}")
+            group.block_bitmap = Bitmap(loads(raw), group.block_bitmap_offset)
+        return group.block_bitmap
+
+    def _inode_bitmap(self, group: BlockGroup) -> Bitmap:
+        if group.inode_bitmap is None:
+            raw = self._driver.read(
+                group.inode_bitmap_offset, BlockGroup.bitmap_size(group.inodes_number)
+            )
+            if checksum(raw) != group.inode_bitmap_checksum:
+                raise ChecksumMismatch(f"inode bitmap of group {group.index}")
+            group.inode_bitmap = Bitmap(loads(raw), group.inode_bitmap_offset)
+        return group.inode_bitmap
+
+    def _write_block_bitmap(self, group: BlockGroup, bitmap: Bitmap) -> None:
+        group.block_bitmap = bitmap
+        group.free_blocks = bitmap.content.count("0")
+        group.block_bitmap_checksum = checksum(bitmap.dumped)
+        self._driver.write(bitmap.offset, bitmap.dumped)
+        self._write_group_descriptor(group)
+
+    def _write_inode_bitmap(self, group: BlockGroup, bitmap: Bitmap) -> None:
+        group.inode_bitmap = bitmap
+        group.free_inodes = bitmap.content.count("0")
+        group.inode_bitmap_checksum = checksum(bitmap.dumped)
+        self._driver.write(bitmap.offset, bitmap.dumped)
+        self._write_group_descriptor(group)
+
+    def _update_refcounts(
+        self,
+        addresses: list[Address],
+        change: Callable[[Bitmap, list[int]], Bitmap],
+    ) -> None:
+        """Apply `change` to the block bitmaps, writing only the groups touched."""
+        by_group: dict[int, list[int]] = {}
+        for addr in addresses:
+            group_index, pos = divmod(addr, self._blocks_per_group)
+            by_group.setdefault(group_index, []).append(pos)
+        for group_index, positions in by_group.items():
+            group = self._groups[group_index]
+            self._write_block_bitmap(group, change(self._block_bitmap(group), positions))
+
+    def _update_inode_bitmap(self, inode_id: int, value: str) -> None:
+        group_index, pos = divmod(inode_id, self._inodes_per_group)
+        group = self._groups[group_index]
+        bitmap = self._inode_bitmap(group)
+        if bitmap.content[pos] == value:
+            return
+        self._write_inode_bitmap(group, bitmap.update(value, [pos]))
+
+    def _refcount(self, addr: Address) -> int:
+        group_index, pos = divmod(addr, self._blocks_per_group)
+        return self._block_bitmap(self._groups[group_index]).refcount(pos)
+
+    def _block_offset(self, addr: Address) -> int:
+        group_index, pos = divmod(addr, self._blocks_per_group)
+        return self._groups[group_index].data_offset + pos * self._block_size
+
+    def _checksum_offset(self, addr: Address) -> int:
+        group_index, pos = divmod(addr, self._blocks_per_group)
+        return self._groups[group_index].checksums_offset + pos * checksum_size
+
+    def _inode_offset(self, inode_id: int) -> int:
+        group_index, pos = divmod(inode_id, self._inodes_per_group)
+        return self._groups[group_index].inode_table_offset + pos * self.__inode_size
+
+    def _inode_group(self, inode_id: int) -> int:
+        return inode_id // self._inodes_per_group
+
+    def _groups_from(self, group_index: int) -> list[BlockGroup]:
+        return self._groups[group_index:] + self._groups[:group_index]
+
+    def _directory_group(self) -> int:
+        # spread directories over the groups, their files then stay beside them
+        return max(
+            self._groups, key=lambda g: (g.free_inodes, g.free_blocks, -g.index)
+        ).index
 
     def _create_directory(self, path: str) -> None:
         path: PurePosixPath = self._resolve_path(path)
@@ -257,7 +624,7 @@ class FileSystem:
             )
         else:
             parent: Directory = self._read_directory(path.parent)
-            inode_id = self._get_free_inode()
+            inode_id = self._get_free_inode(self._directory_group())
             entry = Data(
                 {
                     ".": inode_id,
@@ -277,11 +644,190 @@ class FileSystem:
     def _read_directory(self, path: PurePosixPath) -> Directory:
         inode_id = self._get_file_inode_id(path)
         inode = self._read_inode(inode_id)
-        entry = self._read_data(inode.content.get("data_blocks_map"))
+        entry = self._read_entry(inode)
         return Directory(inode, entry)
 
+    def _read_entry(self, inode: Inode) -> Data:
+        inline_data = inode.content.get("inline_data")
+        if inline_data is not None:
+            return Data(inline_data)
+        return self._read_data(inode.content.get("data_blocks_map"))
+
+    def _fits_inline(self, inode_record: dict) -> bool:
+        # leave room for the read_only flag a snapshot adds later
+        probe = dict(inode_record, read_only=True)
+        return len(Inode(probe).dumped) <= self.__inode_size - checksum_size
+
+    def _check_inode_fits(self, inode_record: dict, blocks_number: int = None) -> None:
+        """Raise InvalidSize unless `inode_record` will fit its slot once stored.
+
+        Inline data that outgrows the inode is taken as spilled to blocks;
+        with `blocks_number` the block map is sized for that many blocks.
+        """
+        probe = dict(inode_record, read_only=True)
+        if "inline_data" in probe and not self._fits_inline(probe):
+            probe.pop("inline_data")
+            blocks_number = -(-probe["file_size"] // self._block_size)
+        if blocks_number is not None:
+            # every address takes at least two bytes of the record
+            if 2 * blocks_number > self.__inode_size:
+                raise InvalidSize
+            try:
+                # the blocks the allocator would hand out now
+                addresses = self._get_free_blocks(
+                    blocks_number, self._inode_group(probe["id"])
+                )
+            except OutOfBlocks:
+                widest = len(self._groups) * self._blocks_per_group
+                addresses = [widest] * blocks_number
+            probe["data_blocks_map"] = addresses
+        if "compression" in probe:
+            chunks_number = -(-probe["file_size"] // self._compression_chunk_size)
+            if len(probe.get("chunks", [])) != chunks_number:
+                probe["chunks"] = [self._compression_chunk_size] * chunks_number
+        if len(Inode(probe).dumped) > self.__inode_size - checksum_size:
+            raise InvalidSize
+
+    def _spill_inline(self, inode_record: dict) -> None:
+        """Move inline data to blocks once the inode record outgrows its slot."""
+        if "inline_data" not in inode_record or self._fits_inline(inode_record):
+            return
+        if inode_record.get("file_type") == "d":
+            self._write_directory(
+                inode_record, inode_record["inline_data"], inline=False
+            )
+        else:
+            self._write_file_data(
+                inode_record, Data(inode_record["inline_data"]), inline=False
+            )
+
+    def _clone_inode(
+        self,
+        inode_id: int,
+        dst: PurePosixPath,
+        read_only: bool,
+        cloned: dict[int, int],
+        skip: int = None,
+    ) -> None:
+        # unwritten data of an open file goes to disk before it is shared
+        self._flush(inode_id)
+        inode_record: dict = self._read_inode(inode_id).content
+        file_type = inode_record.get("file_type")
+        if file_type == "d":
+            self._create_directory(str(dst))
+            entry: dict = self._read_entry(Inode(inode_record)).content
+            for name, child_id in entry.items():
+                if name in (".", "..") or child_id == skip:
+                    continue
+                self._clone_inode(
+                    child_id, dst.joinpath(name), read_only, cloned, skip
+                )
+            clone_id = self._get_file_inode_id(dst)
+        elif file_type == "l":
+            target = str(self._symlink_target(Inode(inode_record)))
+            clone_id = self._create_symlink(dst, target)
+        elif inode_id in cloned:
+            # keep hard links inside the cloned tree pointing at one inode
+            clone_id = cloned[inode_id]
+            clone_record: dict = self._read_inode(clone_id).content
+            clone_record["file_name"].append(dst.name)
+            clone_record["links_cnt"] += 1
+            self._check_inode_fits(clone_record)
+            self._add_file_to_parent_directory_entry(
+                self._read_directory(dst.parent), dst.name, clone_id, file_type
+            )
+            self._spill_inline(clone_record)
+            self._write_inode(Inode(clone_record))
+            return
+        else:
+            parent: Directory = self._read_directory(dst.parent)
+            clone_id = self._get_free_inode(
+                self._inode_group(parent.inode.content["id"])
+            )
+            clone_record = dict(inode_record)
+            clone_record["id"] = clone_id
+            clone_record["file_name"] = [dst.name]
+            clone_record["links_cnt"] = 1
+            self._check_inode_fits(clone_record)
+            self._add_file_to_parent_directory_entry(
+                parent, dst.name, clone_id, file_type
+            )
+            clone_record["data_blocks_map"] = self._share_blocks(
+                inode_record["data_blocks_map"], self._inode_group(clone_id)
+            )
+            clone_record.pop("read_only", None)
+            self._spill_inline(clone_record)
+            self._write_inode(Inode(clone_record))
+        cloned[inode_id] = clone_id
+
+        if read_only:
+            # _fits_inline leaves room for this flag
+            clone_record: dict = self._read_inode(clone_id).content
+            clone_record["read_only"] = True
+            self._write_inode(Inode(clone_record))
+
+    def _share_blocks(
+        self, addresses: list[Address], group_index: int = 0
+    ) -> list[Address]:
+        addresses = list(addresses)
+        added = {}
+        copied = []
+        for i, addr in enumerate(addresses):
+            if self._refcount(addr) + added.get(addr, 0) < Bitmap.max_refcount:
+                added[addr] = added.get(addr, 0) + 1
+            else:
+                copied.append(i)
+        if copied:
+            # blocks at the reference limit are copied instead of shared
+            chunks = [self._read_blocks([addresses[i]]) for i in copied]
+            new_addresses = self._get_free_blocks(len(copied), group_index)
+            self._write_blocks(new_addresses, chunks)
+            for i, addr in zip(copied, new_addresses):
+                addresses[i] = addr
+        shared = [addr for addr, n in added.items() for _ in range(n)]
+        self._update_refcounts(shared, Bitmap.incref)
+        return addresses
+
+    def _create_symlink(self, path: PurePosixPath, target: str) -> int:
+        # short targets live in the inode itself, without a data block
+        inode_record = {
+            "id": self._inodes_number,
+            "file_name": [path.name],
+            "file_type": Symlink.ftype,
+            "links_cnt": Symlink.default_links_cnt,
+            "file_size": len(target.encode()),
+            "data_blocks_map": [],
+            "symlink_target": target,
+        }
+        if self._fits_inline(inode_record):
+            return self._create_file(path=path, file_cls=Symlink, symlink_target=target)
+
+        data = Data(target)
+        if len(data.dumped) > self._block_size:
+            raise TooLongSymlink
+        return self._create_file(path=path, data=data, file_cls=Symlink)
+
+    def _symlink_target(self, inode: Inode) -> PurePosixPath:
+        target = inode.content.get("symlink_target")
+        if target is None:
+            target = self._read_data(inode.content.get("data_blocks_map")).content
+        return PurePosixPath(target)
+
+    def _follow_symlink(self, inode: Inode, follows: int) -> int:
+        inode_id = inode.content.get("id")
+        if inode_id not in self._symlink_cache:
+            if follows >= self.__max_symlink_follows:
+                raise TooManySymlinks
+            self._symlink_cache[inode_id] = self._get_file_inode_id(
+                self._symlink_target(inode), follows=follows + 1
+            )
+        return self._symlink_cache[inode_id]
+
     def _get_file_inode_id(
-        self, path: PurePosixPath, return_symlink_inode_id: bool = False
+        self,
+        path: PurePosixPath,
+        return_symlink_inode_id: bool = False,
+        follows: int = 0,
     ) -> int:
         inode_id = 0
         if len(path.parents) != 0:
@@ -295,100 +841,421 @@ class FileSystem:
                 inode_id: int = parent_entry.content.get(child.name)
                 inode: Inode = self._read_inode(inode_id)
                 if inode.content.get("file_type") == "l":
-                    data: str = self._read_data(
-                        inode.content.get("data_blocks_map")
-                    ).content
-                    symlink_contained_path: PurePosixPath = PurePosixPath(data)
                     if (
                         return_symlink_inode_id
                         and path.name == inode.content.get("file_name")[0]
                     ):
                         return inode_id
-                    inode_id: int = self._get_file_inode_id(symlink_contained_path)
+                    inode_id: int = self._follow_symlink(inode, follows)
 
             else:
                 raise FileDoesNotExist
         return inode_id
 
     def _read_file(self, inode_id) -> Data:
-        inode: Inode = self._read_inode(inode_id)
-        data_blocks_addresses = inode.content.get("data_blocks_map")
-        return self._read_data(data_blocks_addresses)
+        return self._read_entry(self._read_inode(inode_id))
 
     def _read_inode(self, inode_id: int) -> Inode:
-        return Inode(
-            loads(
-                self._driver.read(
-                    self._inode_sector_offset + inode_id * self.__inode_size,
-                    self.__inode_size,
-                )
-            )
-        )
+        raw = self._driver.read(self._inode_offset(inode_id), self.__inode_size)
+        try:
+            return Inode(loads(unseal(raw)))
+        except ChecksumMismatch:
+            raise ChecksumMismatch(f"inode {inode_id}") from None
 
     def _read_data(self, addr_arr: list[Address]) -> Data:
+        return Data(loads(self._read_blocks(addr_arr)))
+
+    def _read_blocks(self, addr_arr: list[Address]) -> bytes:
+        """Read blocks in order, verifying each against its stored crc32."""
         data = []
-        for data_block_addr in addr_arr:
-            data.append(
-                self._driver.read(
-                    self._data_sector_offset + data_block_addr * self._block_size,
-                    self._block_size,
-                )
+        i = 0
+        while i < len(addr_arr):
+            # runs of consecutive blocks are fetched with a single driver call
+            j = i + 1
+            while (
+                j < len(addr_arr)
+                and addr_arr[j] == addr_arr[j - 1] + 1
+                and addr_arr[j] % self._blocks_per_group != 0
+            ):
+                j += 1
+            run = self._driver.read(
+                self._block_offset(addr_arr[i]), self._block_size * (j - i)
             )
-        return Data(loads(b"".join(data)))
+            sums = self._driver.read(
+                self._checksum_offset(addr_arr[i]), checksum_size * (j - i)
+            )
+            for n in range(j - i):
+                block = run[n * self._block_size: (n + 1) * self._block_size]
+                stored = sums[n * checksum_size: (n + 1) * checksum_size]
+                if checksum_bytes(block) != stored:
+                    raise ChecksumMismatch(f"block {addr_arr[i + n]}")
+            data.append(run)
+            i = j
+        return b"".join(data)
+
+    def _read_file_blocks(
+        self, file: FileDescriptor, inode_record: dict, first: int, last: int
+    ) -> bytes:
+        """Read blocks first..last of an open file through its readahead state."""
+        addresses = inode_record["data_blocks_map"]
+        state: Readahead = file.readahead
+        if state.update(first):
+            self.readahead_stats["wasted"] += state.discard(below=first)
+        else:
+            self.readahead_stats["wasted"] += state.discard()
+
+        blocks = {}
+        if state.current is not None and first <= state.current[0] <= last:
+            blocks[state.current[0]] = state.current[1]
+        wanted = range(first, last + 1)
+        if state.busy and any(i not in state.blocks for i in wanted):
+            self.readahead_stats["wasted"] += state.collect()
+        for i in wanted:
+            if i in state.blocks:
+                blocks[i] = state.blocks.pop(i)
+                self.readahead_stats["hits"] += 1
+        missing = [i for i in wanted if i not in blocks]
+        fetched = self._read_blocks([addresses[i] for i in missing])
+        for n, i in enumerate(missing):
+            blocks[i] = fetched[n * self._block_size: (n + 1) * self._block_size]
+        data = b"".join(blocks[i] for i in wanted)
+        state.current = (last, blocks[last])
+        state.last_block = last
+
+        ahead = [
+            i
+            for i in range(last + 1, min(last + 1 + state.window, len(addresses)))
+            if i not in state.blocks
+        ]
+        if ahead and not state.busy:
+            self.readahead_stats["wasted"] += state.collect()
+            if self._readahead_pool is None:
+                self._readahead_pool = ThreadPoolExecutor(max_workers=1)
+            self.readahead_stats["prefetched"] += len(ahead)
+            state.submit(
+                self._readahead_pool.submit(
+                    self._prefetch_blocks, ahead, [addresses[i] for i in ahead]
+                ),
+                len(ahead),
+            )
+        return data
+
+    def _prefetch_blocks(
+        self, indexes: list[int], addresses: list[Address]
+    ) -> dict[int, bytes]:
+        data = self._read_blocks(addresses)
+        return {
+            i: data[n * self._block_size: (n + 1) * self._block_size]
+            for n, i in enumerate(indexes)
+        }
 
-    def _get_free_inode(self) -> int:
-        for i in range(self._inodes_number):
-            if (
-                self._driver.read(
-                    self._inode_sector_offset + i * self.__inode_size, self.__inode_size
-                )
-                == b"\x00"
-            ):
-                return i
+    def _flush(self, inode_id: int) -> None:
+        if inode_id not in self._dirty_files:
+            return
+        open_file: OpenFile = self._open_files.get_inode(inode_id)
+        # the on-disk inode may have changed (links, names) since open
+        inode_record: dict = self._read_inode(inode_id).content
+        open_file.inode = self._write_file_data(inode_record, open_file.data)
+        self._dirty_files.discard(inode_id)
+        self._reserved_blocks.pop(inode_id, None)
+
+    def _sync(self) -> None:
+        for inode_id in list(self._dirty_files):
+            self._flush(inode_id)
+
+    def _reserve_blocks(self, file: FileDescriptor, content: bytes) -> None:
+        """Reserve the blocks `file` needs to store `content`.
+
+        Raises OutOfBlocks if the reservations of all dirty files would
+        exceed the free blocks, InvalidSize if the inode could not map them.
+        The old blocks of a file are freed only after its new ones are
+        written, so they do not count as available.
+        """
+        inode_id = file.inode.content["id"]
+        needed = -(-len(content) // self._block_size)
+        probe = dict(file.inode.content, file_size=len(content))
+        probe.pop("inline_data", None)
+        try:
+            self._check_inode_fits(probe, needed)
+        except InvalidSize:
+            codec = probe.get("compression")
+            if codec is None:
+                raise
+            # compressed files may need far fewer blocks, measure them
+            chunks = Data(content.decode()).compress(
+                self._compression_chunk_size, codec
+            )
+            probe["chunks"] = [len(chunk) for chunk in chunks]
+            needed = -(-sum(probe["chunks"]) // self._block_size)
+            self._check_inode_fits(probe, needed)
+        reserved = sum(self._reserved_blocks.values()) - self._reserved_blocks.get(
+            inode_id, 0
+        )
+        if reserved + needed > sum(group.free_blocks for group in self._groups):
+            raise OutOfBlocks
+        self._reserved_blocks[inode_id] = needed
+
+    def _dirty_bytes(self) -> int:
+        return sum(
+            len(self._open_files.get_inode(inode_id).data.content)
+            for inode_id in self._dirty_files
+        )
+
+    def _drop_readahead(self, inode_id: int) -> None:
+        open_file: OpenFile = self._open_files.get_inode(inode_id)
+        if open_file is None:
+            return
+        for fd in open_file.descriptors:
+            file: FileDescriptor = self._open_files.get(fd)
+            self.readahead_stats["wasted"] += file.readahead.discard()
+
+    def _read_file_data(self, inode: Inode) -> Data | None:
+        inode_record: dict = inode.content
+        if "inline_data" in inode_record:
+            return Data(inode_record["inline_data"])
+        addresses = inode_record.get("data_blocks_map")
+        if len(addresses) == 0:
+            return None
+        if inode_record.get("compression") is None:
+            content = self._read_blocks(addresses)[: inode_record["file_size"]]
+            return Data(content.decode())
+        content = self._read_compressed_range(inode_record, 0, inode_record["file_size"])
+        return Data(content.decode())
+
+    def _read_compressed_range(
+        self, inode_record: dict, start: int, end: int, file: FileDescriptor = None
+    ) -> bytes:
+        if start >= end:
+            return b""
+        codec = inode_record["compression"]
+        addresses = inode_record["data_blocks_map"]
+        first = start // self._compression_chunk_size
+        last = (end - 1) // self._compression_chunk_size
+
+        # compressed chunks are packed back to back, so locate the byte range
+        # covering chunks first..last and read only the blocks holding it
+        chunk_lens = inode_record["chunks"]
+        stream_start = sum(chunk_lens[:first])
+        stream_end = stream_start + sum(chunk_lens[first: last + 1])
+        first_block = stream_start // self._block_size
+        last_block = (stream_end - 1) // self._block_size
+        if file is None:
+            stream = self._read_blocks(addresses[first_block: last_block + 1])
+        else:
+            stream = self._read_file_blocks(file, inode_record, first_block, last_block)
+
+        data = []
+        pos = stream_start - first_block * self._block_size
+        for chunk_len in chunk_lens[first: last + 1]:
+            data.append(decompress(codec, stream[pos: pos + chunk_len]))
+            pos += chunk_len
+        offset = first * self._compression_chunk_size
+        return b"".join(data)[start - offset: end - offset]
+
+    def _iter_inodes(self):
+        for group in self._groups:
+            if group.free_inodes == group.inodes_number:
+                continue
+            base = group.index * self._inodes_per_group
+            for m in re.finditer("1", self._inode_bitmap(group).content):
+                yield self._read_inode(base + m.start())
+
+    def _get_free_inode(self, group_index: int = 0) -> int:
+        for group in self._groups_from(group_index):
+            if group.free_inodes == 0:
+                continue
+            pos = self._inode_bitmap(group).content.find("0")
+            if pos != -1:
+                return group.index * self._inodes_per_group + pos
         raise OutOfInodes
 
     def _write_data(self, addresses: list[Address], data: Data) -> None:
-        chunks = data.split(self._block_size)
+        self._write_blocks(addresses, data.split(self._block_size))
+
+    def _write_blocks(self, addresses: list[Address], chunks: list[bytes]) -> None:
         assert len(addresses) == len(chunks)
         for data_chunk, addr in zip(chunks, addresses):
-            self._driver.write(
-                self._data_sector_offset + addr * self._block_size, data_chunk
-            )
-        self.bitmap = self.bitmap.update("1", addresses)
-        self._driver.write(self.bitmap.offset, self.bitmap.dumped)
+            # whole blocks, so the checksum covers what a read gets back
+            block = data_chunk.ljust(self._block_size, b"\x00")
+            self._driver.write(self._block_offset(addr), block)
+            self._driver.write(self._checksum_offset(addr), checksum_bytes(block))
+        self._update_refcounts(addresses, lambda bitmap, pos: bitmap.update("1", pos))
+
+    def _write_file_data(
+        self, inode_record: dict, data: Data, inline: bool = True
+    ) -> Inode:
+        self._drop_readahead(inode_record["id"])
+        old_addresses = inode_record["data_blocks_map"]
+        inode_record.pop("inline_data", None)
+        inode_record["file_size"] = len(data.content.encode())
+
+        if inline:
+            # tiny files live in the inode: no blocks, no bitmap update
+            inode_record["inline_data"] = data.content
+            inode_record["data_blocks_map"] = []
+            if "compression" in inode_record:
+                inode_record["chunks"] = []
+            if self._fits_inline(inode_record):
+                inode = Inode(inode_record)
+                self._write_inode(inode)
+                self._clear_data_block(old_addresses)
+                return inode
+            inode_record.pop("inline_data")
+
+        group_index = self._inode_group(inode_record["id"])
+        codec = inode_record.get("compression")
+        if codec is None:
+            blocks = data.split_content(self._block_size)
+        else:
+            chunks = data.compress(self._compression_chunk_size, codec)
+            stream = b"".join(chunks)
+            blocks = [
+                stream[i: i + self._block_size]
+                for i in range(0, len(stream), self._block_size)
+            ]
+            inode_record["chunks"] = [len(chunk) for chunk in chunks]
+        # refuse before allocating, the old blocks stay valid on failure
+        self._check_inode_fits(inode_record, len(blocks))
+
+        if self._dedup:
+            addresses = self._write_dedup_blocks(blocks, group_index)
+        else:
+            addresses = self._get_free_blocks(len(blocks), group_index)
+            self._write_blocks(addresses, blocks)
+
+        inode_record["data_blocks_map"] = addresses
+        inode = Inode(inode_record)
+        self._write_inode(inode)
+        # released only once the inode no longer refers to them
+        self._clear_data_block(old_addresses)
+        return inode
 
-    def _allocate_blocks(self, data: Data) -> list[Address]:
+    def _write_directory(
+        self, inode_record: dict, entry: dict, inline: bool = True
+    ) -> None:
+        entry_data = Data(entry)
+        addresses = inode_record["data_blocks_map"]
+        inode_record.pop("inline_data", None)
+        inode_record["file_size"] = len(entry_data.dumped)
+
+        if inline:
+            inode_record["inline_data"] = entry
+            inode_record["data_blocks_map"] = []
+            if self._fits_inline(inode_record):
+                self._clear_data_block(addresses)
+                self._write_inode(Inode(inode_record))
+                return
+            inode_record.pop("inline_data")
+
+        required_blocks_number = -(-len(entry_data.dumped) // self._block_size)
+        if required_blocks_number > len(addresses):
+            addresses = addresses + self._get_free_blocks(
+                required_blocks_number - len(addresses),
+                self._inode_group(inode_record["id"]),
+            )
+        elif required_blocks_number < len(addresses):
+            self._clear_data_block(addresses[required_blocks_number:])
+            addresses = addresses[:required_blocks_number]
+        inode_record["data_blocks_map"] = addresses
+        self._write_inode(Inode(inode_record))
+        self._write_data(addresses, entry_data)
+
+    def _write_dedup_blocks(
+        self, chunks: list[bytes], group_index: int = 0
+    ) -> list[Address]:
+        digests = [self._block_digest(chunk) for chunk in chunks]
+        addresses = [None] * len(chunks)
+        # references queued per block, a block never takes more than max_refcount
+        added = {}
+        new = {}
+        for i, digest in enumerate(digests):
+            addr = self._dedup_index.get(digest)
+            if (
+                addr is not None
+                and self._refcount(addr) + added.get(addr, 0) < Bitmap.max_refcount
+            ):
+                addresses[i] = addr
+                added[addr] = added.get(addr, 0) + 1
+            else:
+                new.setdefault(digest, []).append(i)
+
+        copies = []
+        for digest, positions in new.items():
+            for k in range(0, len(positions), Bitmap.max_refcount):
+                copies.append((digest, positions[k: k + Bitmap.max_refcount]))
+        free_blocks = self._get_free_blocks(len(copies), group_index)
+        new_addresses = []
+        new_chunks = []
+        for addr, (digest, positions) in zip(free_blocks, copies):
+            new_addresses.append(addr)
+            new_chunks.append(chunks[positions[0]])
+            for i in positions:
+                addresses[i] = addr
+            added[addr] = len(positions) - 1
+            self._dedup_index[digest] = addr
+            self._block_digests[addr] = digest
+
+        self._write_blocks(new_addresses, new_chunks)
+        shared = [addr for addr, n in added.items() for _ in range(n)]
+        self._update_refcounts(shared, Bitmap.incref)
+        return addresses
+
+    def _block_digest(self, chunk: bytes) -> bytes:
+        return sha256(chunk.ljust(self._block_size, b"\x00")).digest()
+
+    def _allocate_blocks(self, data: Data, group_index: int = 0) -> list[Address]:
 
         required_blocks_number = 0
         while required_blocks_number * self._block_size < len(data.dumped):
             required_blocks_number += 1
-        return self._get_free_blocks(required_blocks_number)
-
-    def _get_free_blocks(self, n: int) -> list[Address]:
-        bitmap = loads(self._driver.read(self.bitmap.offset, self.bitmap.size))
-        if "0" not in bitmap:
-            raise OutOfBlocks
-        free_blocks = [m.start() for m in re.finditer("0", bitmap)]
-        return free_blocks[:n]
+        return self._get_free_blocks(required_blocks_number, group_index)
+
+    def _get_free_blocks(self, n: int, group_index: int = 0) -> list[Address]:
+        """Find n free blocks, searching from `group_index` onwards."""
+        if n == 0:
+            return []
+        groups = self._groups_from(group_index)
+        if n > 1:
+            # prefer one contiguous run, it is read back with a single call
+            for group in groups:
+                if group.free_blocks < n:
+                    continue
+                run = re.search("0{%d}" % n, self._block_bitmap(group).content)
+                if run is not None:
+                    base = group.index * self._blocks_per_group
+                    return list(range(base + run.start(), base + run.end()))
+        free_blocks = []
+        for group in groups:
+            if group.free_blocks == 0:
+                continue
+            base = group.index * self._blocks_per_group
+            for m in re.finditer("0", self._block_bitmap(group).content):
+                free_blocks.append(base + m.start())
+                if len(free_blocks) == n:
+                    return free_blocks
+        raise OutOfBlocks
 
     def _write_inode(self, inode: Inode) -> None:
+        inode_id = inode.content.get("id")
         self._driver.write(
-            self._inode_sector_offset + inode.content.get("id") * self.__inode_size,
-            inode.dumped,
+            self._inode_offset(inode_id), seal(inode.dumped, self.__inode_size)
         )
+        self._update_inode_bitmap(inode_id, "1")
 
     def _clear_data_block(self, addresses: list[Address]) -> None:
-        for addr in addresses:
-            self._driver.clear(
-                self._data_sector_offset + addr * self._block_size, self._block_size
-            )
-        self.bitmap = self.bitmap.update("0", addresses)
-        self._driver.write(self.bitmap.offset, self.bitmap.dumped)
+        # shared blocks only lose a reference, the last one frees the block
+        self._update_refcounts(addresses, Bitmap.decref)
+        for addr in set(addresses):
+            if self._refcount(addr) != 0:
+                continue
+            self._driver.clear(self._block_offset(addr), self._block_size)
+            digest = self._block_digests.pop(addr, None)
+            if digest is not None and self._dedup_index.get(digest) == addr:
+                self._dedup_index.pop(digest)
 
     def _clear_inode(self, inode_id: int) -> None:
-        self._driver.clear(
-            self._inode_sector_offset + inode_id * self.__inode_size, self.__inode_size
-        )
+        self._driver.clear(self._inode_offset(inode_id), self.__inode_size)
+        self._update_inode_bitmap(inode_id, "0")
 
     def _resolve_path(self, path: str) -> PurePosixPath:
         path = PurePosixPath(path)
@@ -405,82 +1272,80 @@ class FileSystem:
         name: str = None,
         parent: Directory = None,
         inode_id: int = None,
-    ) -> None:
+        compression: str = None,
+        symlink_target: str = None,
+    ) -> int:
         if file_cls.ftype != "d":
             name = path.name
             parent = self._read_directory(path.parent)
-            inode_id = self._get_free_inode()
+            # keep files in their directory's group
+            inode_id = self._get_free_inode(
+                self._inode_group(parent.inode.content["id"])
+            )
 
         if not (file_cls.ftype == "d" and name == "/"):
             self._add_file_to_parent_directory_entry(
                 parent, name, inode_id, file_cls.ftype
             )
 
-        if data is not None:
-            addresses = self._allocate_blocks(data)
-
-            if file_cls.ftype == 'f':
-                size = len(data.content.encode())
-            else:
-                size = len(data.dumped)
-            self._write_data(addresses, data)
-        else:
-            size = 0
-            addresses = []
-
-
-
         inode_record = {
             "id": inode_id,
             "file_name": [name],
             "file_type": file_cls.ftype,
             "links_cnt": file_cls.default_links_cnt,
-            "file_size": size,
-            "data_blocks_map": addresses,
+            "file_size": 0,
+            "data_blocks_map": [],
         }
-        self._write_inode(Inode(inode_record))
+        if compression is not None:
+            inode_record["compression"] = compression
+            inode_record["chunks"] = []
+        if symlink_target is not None:
+            inode_record["symlink_target"] = symlink_target
+            inode_record["file_size"] = len(symlink_target.encode())
+
+        if data is None:
+            self._write_inode(Inode(inode_record))
+        elif file_cls.ftype == "d":
+            self._write_directory(inode_record, data.content)
+        elif file_cls.ftype == "f":
+            self._write_file_data(inode_record, data)
+        else:
+            addresses = self._allocate_blocks(data, self._inode_group(inode_id))
+            self._write_data(addresses, data)
+            inode_record["file_size"] = len(data.dumped)
+            inode_record["data_blocks_map"] = addresses
+            self._write_inode(Inode(inode_record))
+        return inode_id
 
     def _remove_file_from_parent_directory_entry(
-        self, parent: Directory, child_name: str
+        self, parent: Directory, child_name: str, child_type: str
     ) -> None:
+        if parent.inode.content.get("read_only"):
+            raise ReadOnlySnapshot
+        self._symlink_cache = {}
         parent_entry: dict = parent.data.content
         parent_entry.pop(child_name)
-        parent_entry: Data = Data(parent_entry)
 
         parent_inode_record = parent.inode.content
-        parent_inode_record["links_cnt"] -= 1
-        addresses = parent_inode_record["data_blocks_map"]
-
-        # todo test
-        if (
-            self._block_size * len(parent_inode_record["data_blocks_map"])
-            - len(parent_entry.dumped)
-            > self._block_size
-        ):
-            self._clear_data_block(parent_inode_record["data_blocks_map"])
-            addresses = self._allocate_blocks(parent_entry)
-            parent_inode_record["data_blocks_map"] = addresses
-            parent_inode_record["file_size"] = len(parent_entry.dumped)
-        self._write_data(addresses, parent_entry)
-        self._write_inode(Inode(parent_inode_record))
+        if child_type == "d":
+            parent_inode_record["links_cnt"] -= 1
+        self._write_directory(parent_inode_record, parent_entry)
 
     def _add_file_to_parent_directory_entry(
         self, parent: Directory, child_name: str, child_inode_id: int, child_type: str
     ) -> None:
+        if parent.inode.content.get("read_only"):
+            raise ReadOnlySnapshot
         parent_entry = parent.data.content
         if child_name not in parent_entry:
+            self._symlink_cache = {}
             parent_inode_record = parent.inode.content
 
             if child_type == "d":
                 parent_inode_record["links_cnt"] += 1
 
             parent_entry[child_name] = child_inode_id
-            if len(dumps(parent_entry)) > self._block_size * len(
-                parent_inode_record["data_blocks_map"]
-            ):
-                parent_inode_record["data_blocks_map"].extend(self._get_free_blocks(1))
-            self._write_inode(Inode(parent_inode_record))
-            self._write_data(parent_inode_record["data_blocks_map"], Data(parent_entry))
+            self._write_directory(parent_inode_record, parent_entry)
         else:
             raise FileAlreadyExists
 
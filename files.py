@@ -52,30 +52,37 @@ class RegularFile(File):
 
     def read(self, size: Byte) -> bytes:
         data = self.data.content.encode()
+        start, end = self.advance(size, len(data))
+        return data[start:end]
+
+    def advance(self, size: Byte, file_size: Byte) -> tuple[int, int]:
         start = self.seek if self.seek == 0 else self.seek - 1
         end = start + size
         self.seek = end
-        if end > len(data):
-            self.seek = len(data)
-            return data[start:]
-        else:
-            return data[start:end]
+        if end > file_size:
+            self.seek = file_size
+            end = file_size
+        return start, end
 
     def write(self, data: bytes, size: Byte) -> RegularFile:
+        content = self.written_content(data, size)
         if self.data is None:
-            self.data = Data((b"\x00" * self.seek + data[:size]).decode())
-        elif len(self.data.content.encode()) < self.seek:
-            gap_size = len(self.data.content.encode()) - self.seek
-            self.data.content = (
-                self.data.content.encode() + b"\x00" * gap_size + data[:size]
-            ).decode()
+            self.data = Data(content.decode())
         else:
-            self.data.content = (
-                self.data.content.encode()[: self.seek] + data[:size]
-            ).decode()
+            self.data.content = content.decode()
         self.seek += size
         return RegularFile(self.inode, self.data, self.seek)
 
+    def written_content(self, data: bytes, size: Byte) -> bytes:
+        """The file content a write of `data` at the current seek leaves."""
+        if self.data is None:
+            return b"\x00" * self.seek + data[:size]
+        elif len(self.data.content.encode()) < self.seek:
+            gap_size = len(self.data.content.encode()) - self.seek
+            return self.data.content.encode() + b"\x00" * gap_size + data[:size]
+        else:
+            return self.data.content.encode()[: self.seek] + data[:size]
+
     def truncate(self, size: int):
         if self.data is not None and len(self.data.content.encode()) > size:
             self.data.content = self.data.content.encode()[:size].decode()
@@ -52,3 +52,19 @@ class InvalidInput(FileSystemException):
 
 class CannotUnlinkOpenFile(FileSystemException):
     pass
+
+
+class UnknownCompression(FileSystemException):
+    pass
+
+
+class ReadOnlySnapshot(FileSystemException):
+    pass
+
+
+class TooManySymlinks(FileSystemException):
+    pass
+
+
+class ChecksumMismatch(FileSystemException):
+    pass
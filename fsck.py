@@ -0,0 +1,131 @@
+import sys
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from os.path import getsize
+
+from device import StorageDevice
+from driver import Driver
+from file_system import FileSystem
+from fs_exceptions import ChecksumMismatch
+
+Byte = int
+
+
+def _scan_group(
+    driver: Driver, block_size: Byte, inodes_number: int, index: int
+) -> dict:
+    fs = FileSystem(driver, block_size, inodes_number, use_existing=True)
+    return fs.scan_group(index)
+
+
+def fsck(fs: FileSystem, workers: int = None) -> list[str]:
+    """Check the image behind `fs`, return the problems found.
+
+    Every block group is read and checksummed in its own process, the
+    results are then cross-checked: bitmap refcounts against the inode
+    block maps, link counts against directory entries, and inodes no
+    directory refers to.
+    """
+    fs.sync()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        try:
+            scans = list(
+                pool.map(
+                    _scan_group,
+                    repeat(fs.driver),
+                    repeat(fs.block_size),
+                    repeat(fs.inodes_number),
+                    range(fs.groups_number),
+                )
+            )
+        except ChecksumMismatch as e:
+            return [f"checksum mismatch: {e}"]
+
+    problems = []
+    refcounts: dict[int, int] = {}
+    inodes: dict[int, dict] = {}
+    entries: dict[int, dict] = {}
+    for scan in scans:
+        problems += scan["problems"]
+        refcounts.update(scan["refcounts"])
+        inodes.update(scan["inodes"])
+        entries.update(scan["entries"])
+
+    references = Counter(
+        addr for record in inodes.values() for addr in record["data_blocks_map"]
+    )
+    for addr in sorted(set(references) | set(refcounts)):
+        # more references than the bitmap can count is an error too
+        if refcounts.get(addr, 0) != references[addr]:
+            problems.append(
+                f"block {addr}: bitmap refcount {refcounts.get(addr, 0)}, "
+                f"referenced {references[addr]} times"
+            )
+
+    links = Counter()
+    subdirectories = Counter()
+    reachable = {0}
+    pending = [0]
+    while pending:
+        directory_id = pending.pop()
+        for name, child_id in entries.get(directory_id, {}).items():
+            if name in (".", ".."):
+                continue
+            if child_id not in inodes:
+                problems.append(
+                    f"inode {directory_id}: entry {name} refers to "
+                    f"free inode {child_id}"
+                )
+                continue
+            links[child_id] += 1
+            if inodes[child_id]["file_type"] != "d":
+                reachable.add(child_id)
+                continue
+            subdirectories[directory_id] += 1
+            parent_id = entries.get(child_id, {}).get("..")
+            if parent_id is not None and parent_id != directory_id:
+                problems.append(
+                    f"inode {child_id}: .. is {parent_id}, expected {directory_id}"
+                )
+            if child_id not in reachable:
+                reachable.add(child_id)
+                pending.append(child_id)
+
+    for inode_id, record in sorted(inodes.items()):
+        if inode_id not in reachable:
+            problems.append(f"inode {inode_id}: orphan, no directory refers to it")
+            continue
+        if record["file_type"] == "d":
+            expected = 2 + subdirectories[inode_id]
+        else:
+            expected = links[inode_id]
+        if record["links_cnt"] != expected:
+            problems.append(
+                f"inode {inode_id}: links_cnt {record['links_cnt']}, "
+                f"expected {expected}"
+            )
+    return problems
+
+
+def main():
+    if len(sys.argv) not in (3, 4):
+        print("usage: fsck.py <image> <inodes number> [block size]")
+        sys.exit(2)
+    path = sys.argv[1]
+    inodes_number = int(sys.argv[2])
+    block_size = int(sys.argv[3]) if len(sys.argv) == 4 else 4096
+    driver = Driver(StorageDevice(getsize(path), path, use_existing=True))
+    try:
+        fs = FileSystem(driver, block_size, inodes_number, use_existing=True)
+    except ChecksumMismatch as e:
+        print(f"checksum mismatch: {e}")
+        sys.exit(1)
+    problems = fsck(fs)
+    for problem in problems:
+        print(problem)
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
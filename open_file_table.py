@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+from files import RegularFile
+from fs_exceptions import TooManyFilesOpen, WrongFileDescriptorNumber
+from readahead import Readahead
+from writable import Inode, Data
+
+
+class OpenFile:
+    """In-memory state of an open inode, shared by all of its descriptors."""
+
+    def __init__(self, inode: Inode) -> None:
+        self.inode = inode
+        # read on demand, set once the file is written through any descriptor
+        self.data: Data | None = None
+        self.descriptors: set[int] = set()
+
+    @property
+    def refs(self) -> int:
+        return len(self.descriptors)
+
+
+class FileDescriptor(RegularFile):
+    """A seek position and readahead state over a shared OpenFile."""
+
+    def __init__(self, open_file: OpenFile) -> None:
+        super().__init__(open_file.inode, None)
+        self.open_file = open_file
+        self.readahead = Readahead()
+
+    @property
+    def inode(self) -> Inode:
+        return self.open_file.inode
+
+    @property
+    def data(self) -> Data | None:
+        return self.open_file.data
+
+    @data.setter
+    def data(self, value: Data) -> None:
+        self.open_file.data = value
+
+
+class OpenFileTable:
+    """File descriptors and the open inodes they refer to.
+
+    Free descriptors are kept on a stack, so open, close and the "is this
+    inode open" check do not depend on the number of open files.
+    """
+
+    def __init__(self, max_files: int) -> None:
+        # lowest numbers on top, descriptors start at 1
+        self._free: list[int] = list(range(max_files, 0, -1))
+        self._descriptors: dict[int, FileDescriptor] = {}
+        self._inodes: dict[int, OpenFile] = {}
+
+    def open(self, inode: Inode) -> int:
+        if len(self._free) == 0:
+            raise TooManyFilesOpen
+        inode_id = inode.content["id"]
+        open_file = self._inodes.get(inode_id)
+        if open_file is None:
+            open_file = self._inodes[inode_id] = OpenFile(inode)
+        fd = self._free.pop()
+        open_file.descriptors.add(fd)
+        self._descriptors[fd] = FileDescriptor(open_file)
+        return fd
+
+    def close(self, fd: int) -> FileDescriptor:
+        descriptor = self.get(fd)
+        self._descriptors.pop(fd)
+        open_file = descriptor.open_file
+        open_file.descriptors.discard(fd)
+        if open_file.refs == 0:
+            self._inodes.pop(open_file.inode.content["id"])
+        self._free.append(fd)
+        return descriptor
+
+    def get(self, fd: int) -> FileDescriptor:
+        descriptor = self._descriptors.get(fd)
+        if descriptor is None:
+            raise WrongFileDescriptorNumber
+        return descriptor
+
+    def get_inode(self, inode_id: int) -> OpenFile | None:
+        return self._inodes.get(inode_id)
+
+    def is_open(self, inode_id: int) -> bool:
+        return inode_id in self._inodes
+
+    def descriptors(self) -> list[FileDescriptor]:
+        return list(self._descriptors.values())
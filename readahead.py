@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+from concurrent.futures import Future
+
+
+class Readahead:
+    """Sequential access detection and prefetched blocks of one file descriptor.
+
+    Block numbers are indexes into the file's data_blocks_map. The window
+    doubles on every sequential read and collapses on a random one.
+    """
+
+    min_window = 4
+    max_window = 64
+
+    def __init__(self) -> None:
+        self.last_block = None
+        self.window = 0
+        self.blocks: dict[int, bytes] = {}
+        # the last block handed out, small reads tend to come back to it
+        self.current: tuple[int, bytes] | None = None
+        self._pending: Future | None = None
+        self._pending_blocks = 0
+
+    def update(self, first_block: int) -> bool:
+        sequential = (
+            self.last_block is not None
+            and self.last_block <= first_block <= self.last_block + 1
+        )
+        if sequential:
+            self.window = min(max(self.window * 2, self.min_window), self.max_window)
+        else:
+            self.window = 0
+        return sequential
+
+    @property
+    def busy(self) -> bool:
+        return self._pending is not None and not self._pending.done()
+
+    def submit(self, future: Future, blocks_number: int) -> None:
+        self._pending = future
+        self._pending_blocks = blocks_number
+
+    def collect(self) -> int:
+        """Wait for the background prefetch, if any, and keep its blocks.
+
+        A failed prefetch is dropped, the demand read that needs a bad block
+        reports it. Returns the number of blocks lost that way.
+        """
+        if self._pending is None:
+            return 0
+        pending, self._pending = self._pending, None
+        try:
+            self.blocks.update(pending.result())
+        except Exception:
+            return self._pending_blocks
+        return 0
+
+    def discard(self, below: int = None) -> int:
+        """Drop prefetched blocks (all, or those before `below`), return their count."""
+        failed = self.collect()
+        if below is None:
+            self.current = None
+            dropped = len(self.blocks)
+            self.blocks = {}
+            return failed + dropped
+        stale = [i for i in self.blocks if i < below]
+        for i in stale:
+            self.blocks.pop(i)
+        return failed + len(stale)
@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+
+from driver import Driver
+from fs_exceptions import InvalidSize
+
+Byte = int
+Address = int
+
+
+class StripedDriver:
+    """Presents several drivers as one address space striped in `stripe_unit` pieces.
+
+    Logical stripe unit `s` lives on member `s % n` at member stripe `s // n`,
+    so a transfer covering several units is split per member and the members
+    are driven in parallel.
+    """
+
+    def __init__(self, drivers: list[Driver], stripe_unit: Byte = 4096) -> None:
+        if len(drivers) == 0 or stripe_unit <= 0:
+            raise InvalidSize
+        self._drivers = drivers
+        self._stripe_unit = stripe_unit
+        member_size = min(d.device_size for d in drivers)
+        self._member_size = member_size - member_size % stripe_unit
+        self._pool = None
+
+    @property
+    def path(self) -> str:
+        return ",".join(self.paths)
+
+    @property
+    def paths(self) -> list[str]:
+        return [d.path for d in self._drivers]
+
+    @property
+    def device_size(self) -> int:
+        return self._member_size * len(self._drivers)
+
+    @property
+    def stripe_unit(self) -> Byte:
+        return self._stripe_unit
+
+    def write(self, address: Address, data: bytes) -> None:
+        def write_member(member: int, member_address: Address, pieces: list) -> None:
+            chunk = b"".join(data[pos: pos + length] for pos, length in pieces)
+            self._drivers[member].write(member_address, chunk)
+
+        self._run(self._split(address, len(data)), write_member)
+
+    def read(self, address: Address, n_bytes: int) -> bytes:
+        out = bytearray(n_bytes)
+
+        def read_member(member: int, member_address: Address, pieces: list) -> None:
+            total = sum(length for _, length in pieces)
+            chunk = self._drivers[member].read(member_address, total)
+            i = 0
+            for pos, length in pieces:
+                out[pos: pos + length] = chunk[i: i + length]
+                i += length
+
+        self._run(self._split(address, n_bytes), read_member)
+        return bytes(out)
+
+    def clear(self, address: Address, n_bytes: int) -> None:
+        def clear_member(member: int, member_address: Address, pieces: list) -> None:
+            total = sum(length for _, length in pieces)
+            self._drivers[member].clear(member_address, total)
+
+        self._run(self._split(address, n_bytes), clear_member)
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def _split(
+        self, address: Address, n_bytes: int
+    ) -> dict[int, tuple[Address, list[tuple[int, int]]]]:
+        """Map a logical range to `{member: (member address, [(pos, length)])}`.
+
+        The pieces one member gets are contiguous on that member, so each
+        member is served with a single transfer.
+        """
+        if address < 0 or address + n_bytes > self.device_size:
+            raise InvalidSize
+        n = len(self._drivers)
+        segments = {}
+        pos = 0
+        while pos < n_bytes:
+            stripe, offset = divmod(address + pos, self._stripe_unit)
+            length = min(self._stripe_unit - offset, n_bytes - pos)
+            member_address = (stripe // n) * self._stripe_unit + offset
+            segments.setdefault(stripe % n, (member_address, []))[1].append(
+                (pos, length)
+            )
+            pos += length
+        return segments
+
+    def _run(self, segments: dict, func) -> None:
+        if len(segments) <= 1:
+            for member, (member_address, pieces) in segments.items():
+                func(member, member_address, pieces)
+            return
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=len(self._drivers))
+        futures = [
+            self._pool.submit(func, member, member_address, pieces)
+            for member, (member_address, pieces) in segments.items()
+        ]
+        for future in futures:
+            future.result()
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["_pool"] = None
+        return state
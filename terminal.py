@@ -1,6 +1,7 @@
 from device import StorageDevice
 from driver import Driver
 from file_system import FileSystem
+from fsck import fsck
 from fs_exceptions import InvalidInput, FileSystemException
 import re
 
@@ -8,16 +9,46 @@ Byte = int
 Address = int
 
 
-def mkfs(inodes_number: int) -> FileSystem:
+size_units = {"": 1, "K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+
+
+def parse_size(text: str) -> Byte:
+    match = re.fullmatch(r"(\d+)([KMGT]?)", text.upper())
+    if match is None:
+        raise InvalidInput
+    return int(match.group(1)) * size_units[match.group(2)]
+
+
+def mkfs(
+    inodes_number: int,
+    disk_size: Byte = None,
+    block_size: Byte = 4096,
+    compression: str = None,
+    dedup: bool = False,
+) -> FileSystem:
     use_existing_fs = False
-    block_size: Byte = 4096
-    disk_size: Byte = block_size * 50
+    if disk_size is None:
+        disk_size = block_size * 50
 
     # inodes_number = 2000
 
     storage_device = StorageDevice(disk_size, "storage", use_existing=use_existing_fs)
     driver = Driver(storage_device)
-    return FileSystem(driver, block_size, inodes_number, use_existing=use_existing_fs)
+    return FileSystem(
+        driver,
+        block_size,
+        inodes_number,
+        use_existing=use_existing_fs,
+        compression=compression,
+        dedup=dedup,
+    )
+
+
+def check(fs: FileSystem) -> str:
+    problems = fsck(fs)
+    if len(problems) == 0:
+        return "clean"
+    return "\n".join(problems)
 
 
 def default_cmd(*args, **kwargs):
@@ -35,33 +66,57 @@ map_cmd = {
     "cd": FileSystem.cd,
     "open": FileSystem.open,
     "close": FileSystem.close,
+    "fsync": FileSystem.fsync,
     "seek": FileSystem.seek,
     "read": FileSystem.read,
     "write": FileSystem.write,
     "link": FileSystem.link,
     "symlink": FileSystem.symlink,
     "truncate": FileSystem.truncate,
+    "dedup": FileSystem.dedup,
+    "clone": FileSystem.clone,
+    "snapshot": FileSystem.snapshot,
+    "sync": FileSystem.sync,
+    "fsck": check,
 }
 
 
 class Terminal:
     def start_session(self):
 
-        initial_input = input("fs> ").strip()
-        match = re.fullmatch(r"mkfs\s+(\d+)", initial_input)
-        while not match:
+        fs = None
+        while fs is None:
             initial_input = input("fs> ").strip()
-            match = re.fullmatch(r"mkfs\s+(\d+)", initial_input)
-
-        fs = mkfs(int(match.group(1)))
+            match = re.fullmatch(r"mkfs\s+(\d+)((?:\s+\w+)*)", initial_input)
+            if match:
+                # mkfs <inodes> [disk size] [block size] [dedup] [codec]
+                options = match.group(2).split()
+                dedup = "dedup" in options
+                if dedup:
+                    options.remove("dedup")
+                sizes = [o for o in options if o[0].isdigit()]
+                codecs = [o for o in options if not o[0].isdigit()]
+                try:
+                    if len(sizes) > 2 or len(codecs) > 1:
+                        raise InvalidInput
+                    fs = mkfs(
+                        int(match.group(1)),
+                        *[parse_size(size) for size in sizes],
+                        compression=codecs[0] if codecs else None,
+                        dedup=dedup,
+                    )
+                except FileSystemException as e:
+                    print(e.__class__.__name__)
 
         descriptors = {}
 
         while True:
             try:
                 user_input: str = input(f"fs@fs:{fs.cwd}$ ").strip()
-                if re.fullmatch(r"ls", user_input):
-                    command = map_cmd.get("ls", default_cmd)
+                if match := re.fullmatch(
+                    r"ls|dedup|sync|fsck", user_input
+                ):  # ls dedup sync fsck
+                    command = map_cmd.get(match.group(0), default_cmd)
                     out = command(fs)
                     if out is not None:
                         print(out)
@@ -84,9 +139,11 @@ class Terminal:
                     data = match.group(2).encode()
                     size = int(match.group(3))
                     command(fs, fd, data, size)
-                elif match := re.fullmatch(r"close\s+(\w+)", user_input):  # close
-                    command = map_cmd.get("close", default_cmd)
-                    fd = descriptors.get(match.group(1))
+                elif match := re.fullmatch(
+                    r"(close|fsync)\s+(\w+)", user_input
+                ):  # close fsync
+                    command = map_cmd.get(match.group(1), default_cmd)
+                    fd = descriptors.get(match.group(2))
                     if fd is None:
                         raise InvalidInput
 
@@ -114,7 +171,7 @@ class Terminal:
 
                 elif match := re.fullmatch(
                     r"(\w+)\s+(.+)\s+(.+)", user_input
-                ):  # link symlink
+                ):  # link symlink clone
                     command = map_cmd.get(match.group(1), default_cmd)
                     path1 = match.group(2)
                     path2 = match.group(3)
@@ -123,7 +180,7 @@ class Terminal:
 
                 elif match := re.fullmatch(
                     r"(\w+)\s+(.+)", user_input
-                ):  # stat create unlink mkdir rmdir cd
+                ):  # stat create unlink mkdir rmdir cd snapshot
                     command = map_cmd.get(match.group(1), default_cmd)
                     out = command(fs, match.group(2))
                     if out is not None:
@@ -2,6 +2,8 @@ from __future__ import annotations
 
 from pickle import dumps
 
+from compression import compress
+
 
 class Writable:
     def __init__(self, content: str | list | dict) -> None:
@@ -21,6 +23,11 @@ class Writable:
 
 
 class Bitmap(Writable):
+    """One character per block: "0" is a free block, otherwise the character
+    encodes how many files reference the block ("1", "2", ... up to "~")."""
+
+    max_refcount = ord("~") - ord("0")
+
     def __init__(self, data: str, offset: int = 0) -> None:
         super().__init__(data)
         self._offset = offset
@@ -38,7 +45,22 @@ class Bitmap(Writable):
         bitmap_array = list(self.content)
         for p in pos:
             bitmap_array[p] = value
-        return Bitmap("".join(bitmap_array))
+        return Bitmap("".join(bitmap_array), self.offset)
+
+    def refcount(self, pos: int) -> int:
+        return ord(self.content[pos]) - ord("0")
+
+    def incref(self, pos: list[int]) -> Bitmap:
+        bitmap_array = list(self.content)
+        for p in pos:
+            bitmap_array[p] = chr(min(ord(bitmap_array[p]) + 1, ord("~")))
+        return Bitmap("".join(bitmap_array), self.offset)
+
+    def decref(self, pos: list[int]) -> Bitmap:
+        bitmap_array = list(self.content)
+        for p in pos:
+            bitmap_array[p] = chr(max(ord(bitmap_array[p]) - 1, ord("0")))
+        return Bitmap("".join(bitmap_array), self.offset)
 
 
 class Inode(Writable):
@@ -48,7 +70,16 @@ class Inode(Writable):
 
 class Data(Writable):
     def split(self, chunk_size: int) -> list[bytes]:
-        arr = self.dumped
+        return self._chunk(self.dumped, chunk_size)
+
+    def split_content(self, chunk_size: int) -> list[bytes]:
+        return self._chunk(self.content.encode(), chunk_size)
+
+    def compress(self, chunk_size: int, codec: str) -> list[bytes]:
+        return [compress(codec, chunk) for chunk in self.split_content(chunk_size)]
+
+    @staticmethod
+    def _chunk(arr: bytes, chunk_size: int) -> list[bytes]:
         chunks = []
         for i in range(0, len(arr), chunk_size):
             chunks.append(arr[i: i + chunk_size])